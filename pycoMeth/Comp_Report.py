@@ -4,8 +4,13 @@
 
 # Standard library imports
 import os
+import re
+import csv
 from collections import OrderedDict, namedtuple, Counter
+from functools import lru_cache
+from multiprocessing import Pool
 import hashlib
+import uuid
 
 # Third party imports
 from tqdm import tqdm
@@ -14,6 +19,7 @@ import pandas as pd
 import jinja2
 from pyfaidx import Fasta
 from scipy.ndimage import gaussian_filter1d
+from scipy.cluster import hierarchy as sch
 
 # Plotly imports
 import plotly.graph_objs as go
@@ -22,15 +28,114 @@ from plotly.colors import n_colors
 import plotly.figure_factory as ff
 import plotly.offline as py
 
+# Optional fast TSV parsing engine
+try:
+    import pyarrow
+    
+    PYARROW_ENGINE = True
+except (ModuleNotFoundError, ImportError) as E:
+    PYARROW_ENGINE = False
+
+# Optional JIT compilation of hot kernels
+try:
+    from numba import njit
+    
+    NUMBA_JIT = True
+except (ModuleNotFoundError, ImportError) as E:
+    NUMBA_JIT = False
+
+# Optional fast hierarchical clustering
+try:
+    import fastcluster
+    
+    FASTCLUSTER_LINKAGE = True
+except (ModuleNotFoundError, ImportError) as E:
+    FASTCLUSTER_LINKAGE = False
+
+# Optional fast uniform bins histogram
+try:
+    from fast_histogram import histogram1d
+    
+    FAST_HISTOGRAM = True
+except (ModuleNotFoundError, ImportError) as E:
+    FAST_HISTOGRAM = False
+
 # Local imports
 from pycoMeth import __version__ as version
 from pycoMeth.common import *
 from pycoMeth.loader import MetH5Loader
 from pycoMeth.CoordGen import Coord
 
+# ~~~~~~~~~~~~~~~~~~~~~~~~Constants~~~~~~~~~~~~~~~~~~~~~~~~#
+
+# Explicit dtypes of Meth_Comp TSV fields. Lists are kept as strings and only parsed for the rows used
+_list_dtype = "string[pyarrow]" if PYARROW_ENGINE else str
+METHCOMP_DTYPES = {
+    "chromosome": str,
+    "start": np.int64,
+    "end": np.int64,
+    "n_samples": np.int32,
+    "pvalue": np.float64,
+    "adj_pvalue": np.float64,
+    "unique_cpg_pos": str,
+    "labels": _list_dtype,
+    "med_llr_list": _list_dtype,
+    "difference": _list_dtype,
+    "post_hoc_pvalues": _list_dtype,
+    "raw_llr_list": _list_dtype,
+    "raw_pos_list": _list_dtype,
+    "ihw_weight": np.float64,
+    "avg_coverage": _list_dtype,
+    "comment": str,
+}
+
+# Kaleido static exporters per process id
+KALEIDO_D = {}
+
+# HTML tables already rendered, keyed by content digest
+HTML_TABLE_CACHE = OrderedDict()
+HTML_TABLE_CACHE_SIZE = 256
+
+# GFF3 attributes extracted for transcripts
+GFF3_ATTR_RE = re.compile(r"(?:^|;)(ID|Parent|biotype|Name)=([^;]*)", re.IGNORECASE)
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~Helper Functions~~~~~~~~~~~~~~~~~~~~~~~~#
 
 
+def tss_window(tss_arr, start, end, max_tss_distance):
+    """
+    Find the TSS within max_tss_distance of an interval in a sorted TSS array.
+    Return their positions in the array and their signed distance to the interval, sorted by absolute distance
+    """
+    lo = np.searchsorted(tss_arr, start - max_tss_distance, side="left")
+    hi = np.searchsorted(tss_arr, end + max_tss_distance, side="right")
+    tss = tss_arr[lo:hi]
+    # Signed distance to the interval, 0 if the TSS falls within it
+    tss_dist = np.where(tss > end, tss - end, np.where(tss < start, tss - start, 0))
+    order = np.argsort(np.abs(tss_dist), kind="mergesort")
+    return lo + order, tss_dist[order]
+
+
+if NUMBA_JIT:
+    
+    @njit(cache=True)
+    def tss_window(tss_arr, start, end, max_tss_distance):
+        """Compiled equivalent of tss_window computing distances in a single loop without temporary arrays"""
+        lo = np.searchsorted(tss_arr, start - max_tss_distance, side="left")
+        hi = np.searchsorted(tss_arr, end + max_tss_distance, side="right")
+        tss_dist = np.empty(hi - lo, dtype=np.int64)
+        for i in range(hi - lo):
+            tss = tss_arr[lo + i]
+            if tss > end:
+                tss_dist[i] = tss - end
+            elif tss < start:
+                tss_dist[i] = tss - start
+            else:
+                tss_dist[i] = 0
+        order = np.argsort(np.abs(tss_dist), kind="mergesort")
+        return lo + order, tss_dist[order]
+
+
 def is_minimum_difference(min_diff, diff_string):
     diff_list = str_to_list(diff_string)
     # List of all difference inferred from np.diff result
@@ -59,6 +164,7 @@ class Comp_Reporter:
         n_len_bin: int = 500,
         export_static_plots: bool = False,
         report_non_significant: bool = False,
+        worker_processes: int = 1,
         verbose: bool = False,
         quiet: bool = False,
         progress: bool = False,
@@ -79,6 +185,7 @@ class Comp_Reporter:
         self.n_len_bin = n_len_bin
         self.export_static_plots = export_static_plots
         self.report_non_significant = report_non_significant
+        self.worker_processes = worker_processes
         self.verbose = verbose
         self.quiet = quiet
         self.progress = progress
@@ -90,6 +197,7 @@ class Comp_Reporter:
         self.reports_outdir = "interval_reports"
         self.tables_outdir = "interval_tables"
         self.plot_outdir = "static_plots"
+        self.plotlyjs_fn = "plotly.min.js"
         
         # Defaults that will be filled in later
         self.report_posthoc = False
@@ -102,6 +210,7 @@ class Comp_Reporter:
         self.log.warning("Loading and preparing data")
         
         self.src_file = os.path.abspath(methcomp_fn)
+        self.date = datetime.datetime.now().strftime("%d/%m/%y")
         
         self.log.info("Computing source md5")
         self.md5 = md5_str(methcomp_fn)
@@ -111,10 +220,15 @@ class Comp_Reporter:
             h5_read_groups_key=read_groups_key, sample_id_list=sample_id_list, h5_file_list=h5_file_list
         )
         if self.export_static_plots:
-            self.kaleido = Kaleido()
+            self.kaleido = get_kaleido()
     
     def load_methcomp(self):
-        df = pd.read_table(self.methcomp_fn, low_memory=False, dtype={"chromosome": str})
+        # Only pass dtypes of fields present in this file
+        header = pd.read_csv(self.methcomp_fn, sep="\t", nrows=0).columns
+        dtype = {field: field_dtype for field, field_dtype in METHCOMP_DTYPES.items() if field in header}
+        df = pd.read_csv(
+            self.methcomp_fn, sep="\t", dtype=dtype, engine="pyarrow" if PYARROW_ENGINE else "c"
+        )
         
         # Check that the input file was generated by methcomp from samples aggregated with Interval_Aggregate
         req_fields = [
@@ -140,141 +254,131 @@ class Comp_Reporter:
     def get_cpg_df(self, line):
         """"""
         lab_list, llr_list, pos_list, _ = self.loader.read_raw_llrs(Coord("", line.chromosome, line.start, line.end))
-        lab_list = ["Sample {}".format(lab) for lab in lab_list]
+        if not lab_list:
+            return pd.DataFrame()
         
-        cpg_df = pd.DataFrame()
+        # Median llr per CpG position for each sample, aligned in a single concat
+        sample_llr_d = OrderedDict()
         for lab, llr, pos in zip(lab_list, llr_list, pos_list):
-            pos = ["{}-{:,}".format(line.chromosome, pos) for pos in pos]
-            cpg_sdf = pd.DataFrame(index=pos, data=llr, columns=[lab])
-            cpg_sdf = cpg_sdf.groupby(cpg_sdf.index).median()
-            if cpg_df.empty:
-                cpg_df = cpg_sdf
-            else:
-                cpg_df = pd.merge(cpg_df, cpg_sdf, left_index=True, right_index=True, how="outer")
+            pos = [f"{line.chromosome}-{p:,}" for p in pos]
+            sample_llr_d[f"Sample {lab}"] = pd.Series(llr, index=pos, dtype=float).groupby(level=0).median()
         
+        cpg_df = pd.concat(sample_llr_d, axis=1, join="outer", sort=True)
         return cpg_df.T
     
     def get_close_tx_df(self, chromosome, start, end):
         """Find transcripts with a TSS within a given genomic interval"""
-        rdf = self.tx_df.query(
-            "chromosome == '{}' and tss >= {} and tss <= {}".format(
-                chromosome, start - self.max_tss_distance, end + self.max_tss_distance
-            )
-        )
-        tss_dist = []
-        for tx, line in iter_idx_tuples(rdf):
-            if line.tss > end:
-                tss_dist.append(line.tss - end)
-            elif line.tss < start:
-                tss_dist.append(line.tss - start)
-            else:
-                tss_dist.append(0)
-        rdf["distance to tss"] = tss_dist
-        rdf["abs_tss"] = np.abs(tss_dist)
-        rdf.sort_values("abs_tss", inplace=True)
-        rdf = rdf[
-            [
-                "distance to tss",
-                "transcript id",
-                "gene id",
-                "transcript name",
-                "chromosome",
-                "start",
-                "end",
-                "strand",
-                "feature type",
-                "transcript biotype",
-            ]
+        tx_fields = [
+            "distance to tss",
+            "transcript id",
+            "gene id",
+            "transcript name",
+            "chromosome",
+            "start",
+            "end",
+            "strand",
+            "feature type",
+            "transcript biotype",
         ]
-        return rdf
+        if chromosome not in self.tss_by_chrom:
+            return pd.DataFrame(columns=tx_fields)
+        
+        # Binary search of the TSS window in the chromosome sorted TSS positions
+        tss_arr, row_idx = self.tss_by_chrom[chromosome]
+        tss_idx, tss_dist = tss_window(tss_arr, start, end, self.max_tss_distance)
+        rdf = self.tx_df.iloc[row_idx[tss_idx]].assign(**{"distance to tss": tss_dist})
+        return rdf[tx_fields]
     
-    def plot_interval_reports(self, df, top_dict, rank_fn_dict):
+    def plot_interval_reports(self, valid_df, sig_df, top_dict, rank_fn_dict):
         # Prepare src file for report and compute md5
         
         all_interval_summary = []
-        top_interval_summary = []
-        all_cpg_d = OrderedDict()
-        for idx, line in tqdm(
-            iter_idx_tuples(df),
-            total=len(df),
-            unit=" intervals",
-            unit_scale=True,
-            desc="\tProgress",
-            disable=not self.progress,
+        top_interval_summary = [None] * len(top_dict)
+        top_task_list = []
+        cpg_coords = []
+        cpg_labels = []
+        cpg_llrs = []
+        
+        # Coordinates of significant intervals formatted once for all rows
+        coord_arr = (sig_df.chromosome + "-" + sig_df.start.astype(str) + "-" + sig_df.end.astype(str)).to_numpy()
+        
+        # Batch parse the lists of significant intervals only. Labels are shared by most rows, so parse unique ones
+        med_lists = sig_df.med_llr_list.str.strip("[]").str.split(",").to_numpy()
+        lab_list_d = {s: ["Sample {}".format(lab) for lab in str_to_list(s)] for s in sig_df.labels.unique()}
+        lab_lists = sig_df.labels.map(lab_list_d).to_numpy()
+        
+        for i, (idx, line) in enumerate(
+            tqdm(
+                iter_idx_tuples(sig_df),
+                total=len(sig_df),
+                unit=" intervals",
+                unit_scale=True,
+                desc="\tProgress",
+                disable=not self.progress,
+                mininterval=0.5,
+            )
         ):
-            # collect summary stats for significant intervals or all if required
-            if line.adj_pvalue <= self.pvalue_threshold or self.report_non_significant:
-                close_tx_df = self.get_close_tx_df(
-                    chromosome=line.chromosome,
-                    start=line.start,
-                    end=line.end,
-                )
-                all_interval_summary.append(get_interval_summary(line=line, close_tx_df=close_tx_df))
+            # collect summary stats for significant intervals
+            close_tx_df = self.get_close_tx_df(
+                chromosome=line.chromosome,
+                start=line.start,
+                end=line.end,
+            )
+            all_interval_summary.append(get_interval_summary(line=line, close_tx_df=close_tx_df))
             
             # collect median llr for all significant intervals
-            if line.adj_pvalue <= self.pvalue_threshold:
-                lab_list = ["Sample {}".format(lab) for lab in str_to_list(line.labels)]
-                med_list = str_to_list(line.med_llr_list)
-                coord = "{}-{}-{}".format(line.chromosome, line.start, line.end)
-                all_cpg_d[coord] = {lab: llr for lab, llr in zip(lab_list, med_list)}
+            med_list = np.asarray(med_lists[i], dtype=float)
+            cpg_coords.extend([coord_arr[i]] * len(med_list))
+            cpg_labels.extend(lab_lists[i])
+            cpg_llrs.extend(med_list)
             
-            # Extract more data for reports of top hits
+            # Extract more data for reports of top hits. Rendering is deferred to render_top_intervals
             if idx in top_dict:
                 rank = top_dict[idx]["rank"]
-                self.log.debug(f"Ploting top candidates rank: #{rank}")
-                
-                # Extract data from line
-                cpg_df = self.get_cpg_df(line)
-                
-                try:
-                    heatmap_fig = cpg_heatmap(cpg_df, lim_llr=10, min_diff_llr=self.min_diff_llr)
-                    ridgeplot_fig = cpg_ridgeplot(cpg_df, box=False, scatter=True, min_diff_llr=self.min_diff_llr)
-                    interval_df = get_interval_df(line=line, rank=rank)
-                except ValueError as E:
-                    from IPython.core.display import display
-                    
-                    print(line)
-                    display(cpg_df)
-                    raise E
+                bn = top_dict[idx]["bn"]
+                self.log.debug(f"Extracting top candidates rank: #{rank}")
                 
                 # Collect Interval minimal info
-                filename = top_dict[idx]["bn"] + ".html"
-                top_interval_summary.append(
-                    get_interval_summary(line=line, close_tx_df=close_tx_df, rank=rank, out_filename=filename)
+                filename = bn + ".html"
+                top_interval_summary[rank - 1] = get_interval_summary(
+                    line=line, close_tx_df=close_tx_df, rank=rank, out_filename=filename
                 )
                 
-                # Render interval HTML report
-                html_out_file = self.get_detailed_report_link(filename=filename, relative_to="wd")
-                self.write_cpg_interval_html(
-                    out_file=html_out_file,
-                    summary_link="../{}".format(self.summary_report_fn),
-                    previous_link=prev_fn(rank_fn_dict, rank) + ".html",
-                    next_link=next_fn(rank_fn_dict, rank) + ".html",
-                    max_tss_distance=self.max_tss_distance,
-                    interval_df=interval_df,
-                    close_tx_df=close_tx_df,
-                    heatmap_fig=heatmap_fig,
-                    ridgeplot_fig=ridgeplot_fig,
+                # Extract data from line
+                top_task_list.append(
+                    {
+                        "rank": rank,
+                        "cpg_df": self.get_cpg_df(line),
+                        "interval_df": get_interval_df(line=line, rank=rank),
+                        "close_tx_df": close_tx_df,
+                        "previous_link": prev_fn(rank_fn_dict, rank) + ".html",
+                        "next_link": next_fn(rank_fn_dict, rank) + ".html",
+                        "html_out_file": self.get_detailed_report_link(filename=filename, relative_to="wd"),
+                        "table_out_file": os.path.join(self.outdir, self.tables_outdir, bn + ".tsv"),
+                        "heatmap_svg_file": os.path.join(self.outdir, self.plot_outdir, bn + "_heatmap.svg"),
+                        "ridgeplot_svg_file": os.path.join(self.outdir, self.plot_outdir, bn + "_ridgeplot.svg"),
+                    }
                 )
-                
-                # Write out TSV table
-                if not close_tx_df.empty:
-                    table_out_path = os.path.join(self.outdir, self.tables_outdir, top_dict[idx]["bn"] + ".tsv")
-                    close_tx_df.to_csv(table_out_path, sep="\t", index=False)
-                
-                # Try to export static plots if required
-                if self.export_static_plots:
-                    self.kaleido.export_plotly_svg(
-                        fig=heatmap_fig,
-                        fn=os.path.join(self.outdir, self.plot_outdir, top_dict[idx]["bn"] + "_heatmap.svg"),
-                        width=1400,
-                    )
-                    self.kaleido.export_plotly_svg(
-                        fig=ridgeplot_fig,
-                        fn=os.path.join(self.outdir, self.plot_outdir, top_dict[idx]["bn"] + "_ridgeplot.svg"),
-                        width=1400,
-                    )
-        return all_interval_summary, top_interval_summary, all_cpg_d
+        
+        self.render_top_intervals(top_task_list)
+        
+        # collect summary stats for non significant intervals if required
+        if self.report_non_significant:
+            non_sig_df = valid_df[valid_df.adj_pvalue > self.pvalue_threshold]
+            for idx, line in iter_idx_tuples(non_sig_df):
+                close_tx_df = self.get_close_tx_df(
+                    chromosome=line.chromosome,
+                    start=line.start,
+                    end=line.end,
+                )
+                all_interval_summary.append(get_interval_summary(line=line, close_tx_df=close_tx_df))
+        
+        # Pivot median llr to a samples x intervals table, with intervals kept in pvalue order
+        all_cpg_df = pd.DataFrame({"coord": cpg_coords, "label": cpg_labels, "llr": cpg_llrs})
+        all_cpg_df = all_cpg_df.pivot(index="label", columns="coord", values="llr").reindex(columns=coord_arr)
+        all_cpg_df = all_cpg_df.rename_axis(index=None, columns=None)
+        
+        return all_interval_summary, top_interval_summary, all_cpg_df
     
     def create_summary_report(
         self, valid_df, all_cpg_df, all_interval_summary_df, top_interval_summary_df, sample=None
@@ -346,12 +450,15 @@ class Comp_Reporter:
         # Parse GFF3 annotations
         self.log.info("Loading transcripts info from GFF file")
         self.tx_df = get_ensembl_tx(self.gff3_fn)
+        self.tss_by_chrom = get_tss_index(self.tx_df)
         if self.tx_df.empty:
             self.log.error("No valid transcripts found in GFF3 input file")
-        if not all_in(df["chromosome"], self.tx_df["chromosome"]):
+        data_chroms = set(df["chromosome"].unique())
+        missing_chroms = data_chroms.difference(self.tss_by_chrom.keys())
+        if missing_chroms:
             self.log.error(
                 "Not all the chromosomes found in the data file are present in the GFF3 file. This will lead to "
-                "missing transcript ids"
+                "missing transcript ids for: {}".format(", ".join(sorted(missing_chroms)))
             )
         
         # Parse FASTA reference
@@ -359,10 +466,11 @@ class Comp_Reporter:
         chr_len_d = get_chr_len(self.ref_fasta_fn)
         if not chr_len_d:
             self.log.error("No valid reference sequences found in FASTA file")
-        if not all_in(df["chromosome"], chr_len_d.keys()):
+        missing_chroms = data_chroms.difference(chr_len_d.keys())
+        if missing_chroms:
             self.log.error(
                 "Not all the chromosomes found in the data file are present in the Fasta file. This will lead to "
-                "missing reference sequences in the ideogram"
+                "missing reference sequences in the ideogram for: {}".format(", ".join(sorted(missing_chroms)))
             )
         
         # Select only sites with a valid pvalue
@@ -407,16 +515,19 @@ class Comp_Reporter:
         if self.export_static_plots:
             mkdir(os.path.join(outdir, self.plot_outdir), exist_ok=True)
         
+        # Write plotly.js once, shared by all the HTML reports
+        with open(os.path.join(outdir, self.plotlyjs_fn), "w", encoding="utf-8") as fp:
+            fp.write(py.get_plotlyjs())
+        
         # Extract info from each intervals
         self.log.warning("Parsing methcomp data")
         self.log.info("Iterating over intervals with sufficient difference")
         
-        all_interval_summary, top_interval_summary, all_cpg_d = self.plot_interval_reports(
-            valid_df, top_dict, rank_fn_dict
+        all_interval_summary, top_interval_summary, all_cpg_df = self.plot_interval_reports(
+            valid_df, sig_df, top_dict, rank_fn_dict
         )
         
         # Convert to DataFrame
-        all_cpg_df = pd.DataFrame.from_dict(all_cpg_d)
         all_interval_summary_df = get_interval_summary_df(all_interval_summary)
         top_interval_summary_df = get_interval_summary_df(top_interval_summary)
         
@@ -482,49 +593,32 @@ class Comp_Reporter:
                 sample=sample,
             )
     
-    def write_cpg_interval_html(
-        self,
-        out_file,
-        summary_link,
-        previous_link,
-        next_link,
-        max_tss_distance,
-        interval_df,
-        close_tx_df,
-        heatmap_fig,
-        ridgeplot_fig,
-        sample=None,
-    ):
-        """Write CpG interval HTML report"""
-        # Get CpG_Interval template
-        template = get_jinja_template("CpG_Interval.html.j2")
-        
-        # Render pandas dataframes and plotly figures to HTML
-        interval_html = render_df(interval_df)
-        transcript_html = render_df(
-            close_tx_df, empty_msg=f"No transcripts TTS found within {max_tss_distance} bp upstream or downstream"
-        )
-        heatmap_html = render_fig(heatmap_fig)
-        ridgeplot_html = render_fig(ridgeplot_fig)
-        
-        # Render HTML report using Jinja
-        rendering = template.render(
-            plotlyjs=py.get_plotlyjs(),
-            version=version,
-            date=datetime.datetime.now().strftime("%d/%m/%y"),
-            src_file=self.src_file,
-            md5=self.md5,
-            summary_link=summary_link,
-            previous_link=previous_link,
-            next_link=next_link,
-            interval_html=interval_html,
-            transcript_html=transcript_html,
-            heatmap_html=heatmap_html,
-            ridgeplot_html=ridgeplot_html,
-        )
+    def render_top_intervals(self, top_task_list):
+        """Render the reports of top intervals, in parallel if several worker processes are available"""
+        # Options shared by all the interval reports
+        report_opt = {
+            "src_file": self.src_file,
+            "md5": self.md5,
+            "date": self.date,
+            "summary_link": "../{}".format(self.summary_report_fn),
+            "plotlyjs_src": "../{}".format(self.plotlyjs_fn),
+            "max_tss_distance": self.max_tss_distance,
+            "min_diff_llr": self.min_diff_llr,
+            "export_static_plots": self.export_static_plots,
+        }
+        task_list = [dict(report_opt, **task) for task in top_task_list]
         
-        with open(out_file, "w") as fp:
-            fp.write(rendering)
+        self.log.info("Rendering top candidates reports")
+        if self.worker_processes > 1 and len(task_list) > 1:
+            workers = min(self.worker_processes, len(task_list))
+            chunksize = max(1, len(task_list) // (4 * workers))
+            with Pool(workers) as pool:
+                for rank in pool.imap_unordered(render_top_interval, task_list, chunksize=chunksize):
+                    self.log.debug(f"Rendered top candidates rank: #{rank}")
+        else:
+            for task in task_list:
+                rank = render_top_interval(task)
+                self.log.debug(f"Rendered top candidates rank: #{rank}")
     
     def write_summary_html(
         self,
@@ -554,8 +648,10 @@ class Comp_Reporter:
             tss_dist_fig, empty_msg="Not enough significant candidates to render tss distance plot"
         )
         
+        relative_to = "summary" if sample is None else "posthoc"
+        plotlyjs_src = "{}/{}".format(self.get_outputdir(sample=None, relative_to=relative_to), self.plotlyjs_fn)
+        
         if self.report_posthoc:
-            relative_to = "summary" if sample is None else "posthoc"
             link_dir = self.get_outputdir(sample=None, relative_to=relative_to)
             navigation = f"<div><a href='{link_dir}/{self.summary_report_fn}' class=\"navbar-brand mr-2\">Main Summary</a></div><div>&nbsp;</div><div>Post-Hoc test:</div>"
             for other_sample in self.sample_id_list:
@@ -571,10 +667,10 @@ class Comp_Reporter:
         
         # Render HTML report using Jinja
         rendering = template.render(
-            plotlyjs=py.get_plotlyjs(),
+            plotlyjs_src=plotlyjs_src,
             version=version,
             title_text=title,
-            date=datetime.datetime.now().strftime("%d/%m/%y"),
+            date=self.date,
             src_file=self.src_file,
             md5=self.md5,
             summary_html=summary_html,
@@ -607,6 +703,7 @@ def Comp_Report(
     n_len_bin: int = 500,
     export_static_plots: bool = False,
     report_non_significant: bool = False,
+    worker_processes: int = 1,
     verbose: bool = False,
     quiet: bool = False,
     progress: bool = False,
@@ -646,6 +743,8 @@ def Comp_Report(
         Export all the plots from the reports in SVG format.
     * report_non_significant
         Report all valid CpG islands, significant or not in the text report. This option also adds a non-significant track to the TSS_distance plot
+    * worker_processes
+        Number of processes to be launched to render the top interval reports
     """
     Comp_Reporter(**{key: value for key, value in locals().items()})()
 
@@ -653,11 +752,109 @@ def Comp_Report(
 # ~~~~~~~~~~~~~~~~~~~~~~~~HTML generating functions~~~~~~~~~~~~~~~~~~~~~~~~#
 
 
+def render_top_interval(task):
+    """Render the figures, HTML report, transcript table and static plots of a single top interval"""
+    cpg_df = task["cpg_df"]
+    try:
+        heatmap_fig = cpg_heatmap(cpg_df, lim_llr=10, min_diff_llr=task["min_diff_llr"])
+        ridgeplot_fig = cpg_ridgeplot(cpg_df, box=False, scatter=True, min_diff_llr=task["min_diff_llr"])
+    except ValueError as E:
+        interval = task["interval_df"].iloc[0]
+        raise ValueError(
+            f"Cannot plot interval {interval['chromosome']}-{interval['start']}-{interval['end']} "
+            f"(rank #{task['rank']}): {E}"
+        ) from E
+    
+    # Render interval HTML report
+    write_cpg_interval_html(
+        out_file=task["html_out_file"],
+        src_file=task["src_file"],
+        md5=task["md5"],
+        date=task["date"],
+        summary_link=task["summary_link"],
+        plotlyjs_src=task["plotlyjs_src"],
+        previous_link=task["previous_link"],
+        next_link=task["next_link"],
+        max_tss_distance=task["max_tss_distance"],
+        interval_df=task["interval_df"],
+        close_tx_df=task["close_tx_df"],
+        heatmap_fig=heatmap_fig,
+        ridgeplot_fig=ridgeplot_fig,
+    )
+    
+    # Write out TSV table
+    if not task["close_tx_df"].empty:
+        task["close_tx_df"].to_csv(task["table_out_file"], sep="\t", index=False)
+    
+    # Try to export static plots if required
+    if task["export_static_plots"]:
+        kaleido = get_kaleido()
+        kaleido.export_plotly_svg(fig=heatmap_fig, fn=task["heatmap_svg_file"], width=1400)
+        kaleido.export_plotly_svg(fig=ridgeplot_fig, fn=task["ridgeplot_svg_file"], width=1400)
+    
+    return task["rank"]
+
+
+def write_cpg_interval_html(
+    out_file,
+    src_file,
+    md5,
+    date,
+    summary_link,
+    plotlyjs_src,
+    previous_link,
+    next_link,
+    max_tss_distance,
+    interval_df,
+    close_tx_df,
+    heatmap_fig,
+    ridgeplot_fig,
+):
+    """Write CpG interval HTML report"""
+    # Get CpG_Interval template
+    template = get_jinja_template("CpG_Interval.html.j2")
+    
+    # Render pandas dataframes and plotly figures to HTML
+    interval_html = render_df(interval_df)
+    transcript_html = render_df(
+        close_tx_df, empty_msg=f"No transcripts TTS found within {max_tss_distance} bp upstream or downstream"
+    )
+    heatmap_html = render_fig(heatmap_fig)
+    ridgeplot_html = render_fig(ridgeplot_fig)
+    
+    # Render HTML report using Jinja
+    rendering = template.render(
+        plotlyjs_src=plotlyjs_src,
+        version=version,
+        date=date,
+        src_file=src_file,
+        md5=md5,
+        summary_link=summary_link,
+        previous_link=previous_link,
+        next_link=next_link,
+        interval_html=interval_html,
+        transcript_html=transcript_html,
+        heatmap_html=heatmap_html,
+        ridgeplot_html=ridgeplot_html,
+    )
+    
+    with open(out_file, "w") as fp:
+        fp.write(rendering)
+
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~GFF/FASTA parsing functions~~~~~~~~~~~~~~~~~~~~~~~~#
 
 
+@lru_cache(maxsize=None)
 def get_chr_len(fasta_fn):
-    """Extract reference sequences length from fasta files"""
+    """Extract reference sequences length from fasta files, only once per file for all the report sections"""
+    # Read lengths directly from the faidx index if it is up to date
+    fai_fn = fasta_fn + ".fai"
+    if file_readable(fai_fn) and os.path.getmtime(fai_fn) >= os.path.getmtime(fasta_fn):
+        fai_df = pd.read_csv(fai_fn, sep="\t", header=None, usecols=[0, 1], dtype={0: str, 1: np.int64})
+        return OrderedDict(zip(fai_df[0], fai_df[1]))
+    
+    # Otherwise let pyfaidx (re)build the index while iterating over sequences
     len_d = OrderedDict()
     with Fasta(fasta_fn) as fa:
         for seq in fa:
@@ -665,61 +862,93 @@ def get_chr_len(fasta_fn):
     return len_d
 
 
-def get_ensembl_tx(gff3_fn):
+def get_ensembl_tx(gff3_fn, chunksize=1000000):
     """Simple parsing function transcript data from ensembl GFF3 files"""
-    l = []
     open_fun, open_mode = (gzip.open, "rt") if gff3_fn.endswith(".gz") else (open, "r")
     
+    # Verify that GFF3 tag is present in header before any record
     with open_fun(gff3_fn, open_mode) as fp:
-        
-        valid_file = False
         for line in fp:
-            # Verify that GFF3 tag is present in header
             if line.startswith("##gff-version 3"):
-                valid_file = True
-            
+                break
             elif not line.startswith("#"):
-                
-                # Raise error if GFF3 tag not previously found in header
-                if not valid_file:
-                    raise pycoMethError("GFF3 tag not found in file header. Please provide an Ensembl GFF3 file")
-                
-                ls = line.strip().split("\t")
-                # Define transcript as feature type containing RNA or transcript and with a gene as a Parent
-                if ("RNA" in ls[2] or "transcript" in ls[2]) and "Parent=gene" in ls[8]:
-                    
-                    d = OrderedDict()
-                    d["chromosome"] = ls[0]
-                    d["strand"] = ls[6]
-                    d["start"] = int(ls[3])
-                    d["end"] = int(ls[4])
-                    d["tss"] = d["start"] if d["strand"] == "+" else d["end"]
-                    d["feature type"] = ls[2]
-                    
-                    # Parse attributes
-                    attrs = OrderedDict()
-                    try:
-                        for a in ls[8].split(";"):
-                            i, j = a.split("=")
-                            attrs[i.lower()] = j.lower()
-                    except Exception:
-                        pass
-                    
-                    # Extract specific attrs
-                    d["transcript id"] = attrs.get("id", pd.NA).strip("transcript:")
-                    d["gene id"] = attrs.get("parent", pd.NA).strip("gene:")
-                    d["transcript biotype"] = attrs.get("biotype", pd.NA)
-                    d["transcript name"] = attrs.get("name", pd.NA)
-                    l.append(d)
+                raise pycoMethError("GFF3 tag not found in file header. Please provide an Ensembl GFF3 file")
+    
+    # Stream records through the pandas C parser. Comment lines are filtered on the first column only since
+    # attribute values may contain unescaped "#"
+    try:
+        reader = pd.read_csv(
+            gff3_fn,
+            sep="\t",
+            header=None,
+            names=list(range(9)),
+            dtype=str,
+            keep_default_na=False,
+            quoting=csv.QUOTE_NONE,
+            engine="c",
+            chunksize=chunksize,
+        )
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
+    
+    tx_df_list = []
+    for chunk in reader:
+        # Define transcript as feature type containing RNA or transcript and with a gene as a Parent
+        chunk = chunk[
+            ~chunk[0].str.startswith("#")
+            & chunk[2].str.contains("RNA|transcript", na=False)
+            & chunk[8].str.contains("Parent=gene", regex=False, na=False)
+        ]
+        if chunk.empty:
+            continue
+        chunk = chunk.astype({3: np.int64, 4: np.int64})
         
-        df = pd.DataFrame(l)
-        df = df.fillna(pd.NA)
-        return df
+        d = OrderedDict()
+        d["chromosome"] = chunk[0]
+        d["strand"] = chunk[6]
+        d["start"] = chunk[3]
+        d["end"] = chunk[4]
+        d["tss"] = np.where(chunk[6] == "+", chunk[3], chunk[4])
+        d["feature type"] = chunk[2]
+        
+        # Extract specific attrs with a single regex pass per record
+        attrs_df = pd.DataFrame(
+            [{i.lower(): j.lower() for i, j in attrs} for attrs in chunk[8].str.findall(GFF3_ATTR_RE)],
+            index=chunk.index,
+            columns=["id", "parent", "biotype", "name"],
+            dtype=object,
+        )
+        d["transcript id"] = attrs_df["id"].str.replace(r"^transcript:", "", regex=True)
+        d["gene id"] = attrs_df["parent"].str.replace(r"^gene:", "", regex=True)
+        d["transcript biotype"] = attrs_df["biotype"]
+        d["transcript name"] = attrs_df["name"]
+        
+        tx_df_list.append(pd.DataFrame(d))
+    
+    if not tx_df_list:
+        return pd.DataFrame()
+    
+    df = pd.concat(tx_df_list, ignore_index=True)
+    df = df.fillna(pd.NA)
+    return df
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~DataFrame functions~~~~~~~~~~~~~~~~~~~~~~~~#
 
 
+def get_tss_index(tx_df):
+    """Index transcripts per chromosome as (sorted TSS positions, tx_df row positions) for binary search"""
+    tss_by_chrom = OrderedDict()
+    if tx_df.empty:
+        return tss_by_chrom
+    
+    tss_all = tx_df["tss"].to_numpy()
+    for chromosome, row_idx in tx_df.groupby("chromosome", sort=False).indices.items():
+        order = np.argsort(tss_all[row_idx], kind="stable")
+        tss_by_chrom[chromosome] = (tss_all[row_idx][order], row_idx[order])
+    return tss_by_chrom
+
+
 def get_interval_df(line, rank):
     """Generate a single line dataframe describing the current interval"""
     
@@ -808,8 +1037,9 @@ def cpg_heatmap(
     if len(df.columns) <= 1:
         return None
     
-    # Fill missing values by 0 = ambiguous methylation
-    df = df.fillna(0)
+    # Fill missing values by 0 = ambiguous methylation, in a single float32 copy of the data
+    vals = df.to_numpy(dtype=np.float32, copy=True)
+    np.nan_to_num(vals, copy=False)
     
     # Prepare subplot aread
     fig = make_subplots(
@@ -820,20 +1050,32 @@ def cpg_heatmap(
         specs=[[{"type": "heatmap"}, {"type": "scatter"}]],
     )
     
-    # Plot dendogramm
+    # Precompute the linkage once (same complete linkage as the plotly default) and plot dendogramm
+    if FASTCLUSTER_LINKAGE:
+        Z = fastcluster.linkage(vals, method="complete", metric="euclidean")
+    else:
+        Z = sch.linkage(vals, method="complete", metric="euclidean")
     dendrogram = ff.create_dendrogram(
-        df.values, labels=df.index, orientation="left", color_threshold=0, colorscale=["grey"]
+        vals,
+        labels=df.index,
+        orientation="left",
+        color_threshold=0,
+        colorscale=["grey"],
+        distfun=lambda x: x,
+        linkagefun=lambda x: Z,
     )
     for data in dendrogram.data:
         fig.add_trace(data, row=1, col=2)
     
     # Reorder rows
     labels_ordered = np.flip(dendrogram.layout["yaxis"]["ticktext"])
-    df = df.reindex(labels_ordered)
+    order = df.index.get_indexer(labels_ordered)
+    vals = vals[order]
+    ylabels = df.index.to_numpy()[order]
     
     # Define min_llr if not given = symetrical 2nd percentile
     if not lim_llr:
-        lim_llr = max(np.absolute(np.nanpercentile(df.values, [2, 98])))
+        lim_llr = max(np.absolute(np.nanpercentile(vals, [2, 98])))
     
     # Define colorscale
     offset = min_diff_llr / lim_llr * 0.5
@@ -847,9 +1089,9 @@ def cpg_heatmap(
     # plot heatmap
     heatmap = go.Heatmap(
         name="heatmap",
-        x=df.columns,
-        y=df.index,
-        z=df.values,
+        x=df.columns.to_numpy(),
+        y=ylabels,
+        z=vals,
         zmin=-lim_llr,
         zmax=lim_llr,
         zmid=0,
@@ -913,10 +1155,8 @@ def cpg_ridgeplot(
         return None
     
     # Sorted labels by median llr
-    d = OrderedDict()
-    for lab, row in iter_idx_tuples(df):
-        d[lab] = np.nanmedian(row)
-    sorted_labels = [i for i, j in sorted(d.items(), key=lambda t: t[1])]
+    medians = np.nanmedian(df.to_numpy(dtype=float), axis=1)
+    sorted_labels = df.index[np.argsort(medians, kind="stable")].tolist()
     
     # Define color map depending on number of samples
     cmap = n_colors(unmethylated_color, methylated_color, len(sorted_labels), colortype="rgb")
@@ -1025,18 +1265,16 @@ def category_barplot(
     if len(df.columns) <= 1:
         return None
     
-    # Count values per categories
+    # Count values per categories for all samples at once
+    vals = df.to_numpy(dtype=float)
     d = OrderedDict()
-    for sample_id, llr_list in df.iterrows():
-        sample_d = OrderedDict()
-        sample_d["Unmethylated"] = len(llr_list[llr_list <= -min_diff_llr])
-        sample_d["Methylated"] = len(llr_list[llr_list >= min_diff_llr])
-        sample_d["Ambiguous"] = len(llr_list[(llr_list > -min_diff_llr) & (llr_list < min_diff_llr)])
-        sample_d["No data"] = len(llr_list[llr_list.isna()])
-        d[sample_id] = sample_d
+    d["Unmethylated"] = (vals <= -min_diff_llr).sum(axis=1)
+    d["Methylated"] = (vals >= min_diff_llr).sum(axis=1)
+    d["No data"] = np.isnan(vals).sum(axis=1)
+    d["Ambiguous"] = vals.shape[1] - d["Unmethylated"] - d["Methylated"] - d["No data"]
     
     # Cast to dataframe and reorder per value
-    count_df = pd.DataFrame.from_dict(d)
+    count_df = pd.DataFrame(d, index=df.index).T
     count_df = count_df.reindex(columns=count_df.columns.sort_values())
     
     # Generate barplot per category
@@ -1101,73 +1339,71 @@ def chr_ideogram_plot(
         n_len_bin = longest_seq
     bin_len = longest_seq // n_len_bin
     
-    # Filter out sequences shorter than bin length and store idx for numpy array indexing
-    chr_d = OrderedDict()
-    idx = 0
-    for seq_name, seq_len in reversed(list(chr_len_d.items())):
-        if seq_len > bin_len:
-            chr_d[seq_name] = {"idx": idx, "len": seq_len}
-            idx += 1
+    # Filter out sequences shorter than bin length and store idx for numpy array indexing, in reverse order
+    seq_names = list(chr_len_d.keys())
+    seq_lens = np.fromiter(chr_len_d.values(), dtype=np.int64, count=len(chr_len_d))
+    selected = np.flatnonzero(seq_lens > bin_len)[::-1]
+    chr_d = OrderedDict((seq_names[i], {"idx": idx, "len": int(seq_lens[i])}) for idx, i in enumerate(selected))
     # If no valid chromosome
     if not chr_d:
         return None
     
     # Create zero filled array to count coverage per genomic windows
-    cov_array = np.zeros((len(chr_d), n_len_bin + 1))
-    # Fill in array significant site coordinates
-    # for chrom, start, end in all_cpg_d.keys():
-    for coord in all_cpg_df.columns:
-        chrom, start, end = coord.split("-")
-        start = int(start)
-        end = int(end)
-        
-        if chrom in chr_d:
-            chr_idx = chr_d[chrom]["idx"]
-            bin_pos = int((start + (end - start) / 2) / bin_len)
-            cov_array[chr_idx][bin_pos] += 1
+    cov_array = np.zeros((len(chr_d), n_len_bin + 1), dtype=np.float32)
+    # Fill in array significant site coordinates, parsed all at once from the chrom-start-end column names
+    if len(all_cpg_df.columns):
+        coords = pd.Series(all_cpg_df.columns).str.rsplit("-", n=2, expand=True)
+        starts = coords[1].to_numpy(np.int64)
+        ends = coords[2].to_numpy(np.int64)
+        chr_codes = pd.Categorical(coords[0], categories=list(chr_d.keys())).codes
+        bin_pos = ((starts + ends) // 2 // bin_len).astype(np.intp)
+        valid = chr_codes >= 0
+        np.add.at(cov_array, (chr_codes[valid], bin_pos[valid]), 1)
     
-    cov_array[cov_array == 0] = np.nan
     # If no data entered in cov_array
-    if np.all(np.isnan(cov_array)):
+    covered = cov_array[cov_array > 0]
+    if not len(covered):
         return None
     
+    # Colorscale upper bound = 99th percentile of covered bins, selected in linear time
+    k = max(1, int(0.99 * len(covered)))
+    zmax = np.partition(covered, k - 1)[k - 1]
+    
     # Define x and y labels
     y_lab = ["chr {}".format(i) for i in chr_d.keys()]
-    x_lab = [i * bin_len for i in range(0, n_len_bin + 1)]
+    x_lab = np.arange(n_len_bin + 1, dtype=np.int64) * bin_len
     
     fig = go.Figure()
     
     # Plot heatmap
     heatmap = go.Heatmap(
-        z=cov_array,
+        z=np.where(cov_array > 0, cov_array, np.nan),
         y=y_lab,
         x=x_lab,
         colorscale=colorscale,
         zmin=0,
-        zmax=np.nanquantile(cov_array, 0.99),
+        zmax=zmax,
         ygap=10,
         hoverongaps=False,
         hovertemplate="Significant intervals: %{z}<extra>%{y}:%{x:,}</extra>",
     )
     fig.add_trace(heatmap)
     
-    # Define shapes for chromosome shadowing
-    for seq_name, seq_data in chr_d.items():
-        seq_idx = seq_data["idx"]
-        seq_len = seq_data["len"]
-        fig.add_shape(
-            go.layout.Shape(
-                type="rect",
-                x0=0,
-                y0=seq_idx - 0.4,
-                x1=seq_len,
-                y1=seq_idx + 0.4,
-                fillcolor="whitesmoke",
-                layer="below",
-                line_width=0,
-                name=seq_name,
-            )
+    # Define shapes for chromosome shadowing, added all at once with the layout
+    shapes = [
+        go.layout.Shape(
+            type="rect",
+            x0=0,
+            y0=seq_data["idx"] - 0.4,
+            x1=seq_data["len"],
+            y1=seq_data["idx"] + 0.4,
+            fillcolor="whitesmoke",
+            layer="below",
+            line_width=0,
+            name=seq_name,
         )
+        for seq_name, seq_data in chr_d.items()
+    ]
     
     # tweak figure layout
     if not fig_height:
@@ -1181,6 +1417,7 @@ def chr_ideogram_plot(
             "width": fig_width,
             "height": fig_height,
             "margin": {"t": 50, "b": 50},
+            "shapes": shapes,
         },
         xaxis={
             "ticks": "outside",
@@ -1217,12 +1454,16 @@ def tss_dist_plot(
     
     """Plot an ideogram of significant sites distribution per chromosome """
     
-    sig_val = df["distance to tss"][df["pvalue"] <= pvalue_threshold].dropna()
-    non_sig_val = df["distance to tss"][df["pvalue"] > pvalue_threshold].dropna()
-    if sig_val.empty:
+    # Split distances of intervals with a transcript by significance in a single pass over the underlying arrays
+    dist = df["distance to tss"].to_numpy(dtype=np.float64, na_value=np.nan)
+    pvalue = df["pvalue"].to_numpy(dtype=np.float64, na_value=np.nan)
+    has_tss = ~np.isnan(dist)
+    sig_val = dist[has_tss & (pvalue <= pvalue_threshold)]
+    non_sig_val = dist[has_tss & (pvalue > pvalue_threshold)]
+    if not len(sig_val):
         return None
     
-    if not non_sig_val.empty:
+    if len(non_sig_val):
         x_ns, y_ns = gaussian_hist(
             val_list=non_sig_val, start=-max_distance, stop=max_distance, num=n_bins, smooth_sigma=smooth_sigma
         )
@@ -1246,7 +1487,7 @@ def tss_dist_plot(
     fig.add_trace(sig_trace)
     
     # Add non significant trace if data available
-    if not non_sig_val.empty:
+    if len(non_sig_val):
         ns_trace = go.Scatter(
             x=x_ns,
             y=y_ns,
@@ -1277,6 +1518,15 @@ def tss_dist_plot(
 # ~~~~~~~~~~~~~~~~~~~~~~~~Help functions~~~~~~~~~~~~~~~~~~~~~~~~#
 
 
+def get_kaleido():
+    """Get the Kaleido static exporter of the current process. Forked workers each start their own"""
+    pid = os.getpid()
+    if pid not in KALEIDO_D:
+        KALEIDO_D[pid] = Kaleido()
+    return KALEIDO_D[pid]
+
+
+@lru_cache(maxsize=None)
 def get_jinja_template(template_fn):
     """Load Jinja template"""
     try:
@@ -1296,15 +1546,41 @@ def render_df(df, empty_msg="No data"):
     # Return placeholder if empty
     if df.empty:
         return f"<div class='empty'><p class='empty-title h6'>{empty_msg}</p></div>"
-    else:
-        table = df.to_html(
-            classes=["table", "table-striped", "table-hover", "table-scroll"],
-            border=0,
-            index=False,
-            justify="justify-all",
-            escape=False,
-        )
-        return table
+    
+    # Return previous rendering of an identical table
+    key = df_digest(df)
+    if key is not None and key in HTML_TABLE_CACHE:
+        HTML_TABLE_CACHE.move_to_end(key)
+        return HTML_TABLE_CACHE[key]
+    
+    table = df.to_html(
+        classes=["table", "table-striped", "table-hover", "table-scroll"],
+        border=0,
+        index=False,
+        justify="justify-all",
+        escape=False,
+    )
+    if key is not None:
+        HTML_TABLE_CACHE[key] = table
+        if len(HTML_TABLE_CACHE) > HTML_TABLE_CACHE_SIZE:
+            HTML_TABLE_CACHE.popitem(last=False)
+    return table
+
+
+def df_digest(df):
+    """Hash the content of a dataframe, ignoring its index, with vectorized row hashing. None if not hashable"""
+    try:
+        h = hashlib.md5(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    except TypeError:
+        return None
+    h.update(repr((list(df.columns), list(df.dtypes))).encode())
+    # Null values hash alike but render differently (None, NaN, <NA>), so add the kind of null cells to the key
+    for col_idx, (_, col) in enumerate(df.items()):
+        if col.dtype == object:
+            null_pos = np.flatnonzero(col.isna().to_numpy())
+            if len(null_pos):
+                h.update(repr((col_idx, null_pos.tolist(), [repr(v) for v in col.iloc[null_pos]])).encode())
+    return h.hexdigest()
 
 
 def render_fig(fig, empty_msg="No data"):
@@ -1314,14 +1590,15 @@ def render_fig(fig, empty_msg="No data"):
         return f"<div class='empty'><p class='empty-title h6'>{empty_msg}</p></div>"
     
     fig.update_layout(margin={"t": 50, "b": 50})
-    rendering = py.plot(
-        fig,
-        output_type="div",
-        include_plotlyjs=False,
-        image_width="",
-        image_height="",
-        show_link=False,
-        auto_open=False,
+    
+    # Serialize the figure once and let plotly.js mount it. Closing tags are escaped to keep the script block intact
+    div_id = str(uuid.uuid4())
+    fig_json = fig.to_json(validate=False).replace("</", "<\\/")
+    rendering = (
+        f'<div><div id="{div_id}" class="plotly-graph-div" style="height:100%; width:100%;"></div>'
+        f'<script type="text/javascript">{{ const fig = {fig_json}; '
+        f'Plotly.newPlot("{div_id}", fig.data, fig.layout, {{"responsive": true, "showLink": false}}); }}'
+        "</script></div>"
     )
     return rendering
 
@@ -1338,22 +1615,92 @@ def next_fn(rank_fn_dict, rank):
     return rank_fn_dict[prev_rank]
 
 
-def md5_str(fn):
-    """Compute md5 has for a given file"""
+def md5_str(fn, buffer_size=1 << 20):
+    """Compute md5 has for a given file, streamed through a reusable buffer"""
+    # Python >= 3.11 runs the read/update loop in C
+    if hasattr(hashlib, "file_digest"):
+        with open(fn, "rb") as f:
+            return hashlib.file_digest(f, "md5").hexdigest()
+    
     hash_md5 = hashlib.md5()
-    with open(fn, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(fn, "rb", buffering=0) as f:
+        for n in iter(lambda: f.readinto(buffer), 0):
+            hash_md5.update(view[:n])
     return hash_md5.hexdigest()
 
 
+def uniform_histogram(val_list, start, stop, n_bins):
+    """Count values in n_bins uniform bins between start and stop, the last bin including stop as in np.histogram"""
+    vals = np.asarray(val_list, dtype=np.float64)
+    if FAST_HISTOGRAM:
+        y = histogram1d(vals, bins=n_bins, range=(start, stop))
+        # Values equal to the upper bound are excluded by fast_histogram
+        y[-1] += np.count_nonzero(vals == stop)
+        return y
+    
+    vals = vals[(vals >= start) & (vals <= stop)]
+    idx = ((vals - start) * (n_bins / (stop - start))).astype(np.intp)
+    idx[idx == n_bins] = n_bins - 1
+    return np.bincount(idx, minlength=n_bins)
+
+
+def smoothed_histogram(vals, start, stop, n_bins, sigma):
+    """Normalised histogram over n_bins uniform bins between start and stop, smoothed with a gaussian filter"""
+    # Compute histogram over uniform bins with a direct bin index computation instead of a bin edges search
+    y = uniform_histogram(vals, start=start, stop=stop, n_bins=n_bins)
+    # Normalise and smooth y data
+    y = y.astype(np.float64, copy=False)
+    y /= y.sum()
+    return gaussian_filter1d(y, sigma=sigma)
+
+
+if NUMBA_JIT:
+    
+    @njit(cache=True)
+    def smoothed_histogram(vals, start, stop, n_bins, sigma):
+        """
+        Compiled equivalent of smoothed_histogram doing the binning, normalisation and gaussian smoothing in plain
+        loops. Same kernel as gaussian_filter1d defaults: truncated at 4 sigma with reflected edges
+        """
+        # Count values in uniform bins, the last bin including stop
+        y = np.zeros(n_bins, dtype=np.float64)
+        scale = n_bins / (stop - start)
+        total = 0
+        for v in vals:
+            if v >= start and v <= stop:
+                i = min(int((v - start) * scale), n_bins - 1)
+                y[i] += 1
+                total += 1
+        y /= total
+        
+        # Normalised gaussian kernel
+        radius = int(4.0 * sigma + 0.5)
+        kernel = np.empty(2 * radius + 1, dtype=np.float64)
+        for j in range(-radius, radius + 1):
+            kernel[j + radius] = np.exp(-0.5 * j * j / (sigma * sigma))
+        kernel /= kernel.sum()
+        
+        # Convolve with reflection of the histogram around its edges
+        smoothed = np.empty(n_bins, dtype=np.float64)
+        for i in range(n_bins):
+            acc = 0.0
+            for j in range(-radius, radius + 1):
+                k = i + j
+                while k < 0 or k >= n_bins:
+                    k = -k - 1 if k < 0 else 2 * n_bins - k - 1
+                acc += kernel[j + radius] * y[k]
+            smoothed[i] = acc
+        return smoothed
+
+
 def gaussian_hist(val_list, start, stop, num, smooth_sigma=1):
     """return a histogram smoothed with a gaussian filter"""
-    # Compute histogram with numpy
-    y, bins = np.histogram(a=val_list, bins=np.linspace(start=start, stop=stop, num=num))
+    bins = np.linspace(start=start, stop=stop, num=num)
+    y = smoothed_histogram(
+        np.asarray(val_list, dtype=np.float64), start=start, stop=stop, n_bins=num - 1, sigma=smooth_sigma
+    )
     # x labels = middle of each bins
-    x = [(bins[i] + bins[i + 1]) / 2 for i in range(0, len(bins) - 1)]
-    # Normalise and smooth y data
-    y = y / y.sum()
-    y = gaussian_filter1d(y, sigma=smooth_sigma)
+    x = 0.5 * (bins[:-1] + bins[1:])
     return (x, y)
@@ -1,6 +1,7 @@
 from pathlib import Path
 from typing import IO, List
 from multiprocessing import Queue, Process, Pool, Manager
+from threading import Thread
 import logging
 
 import tqdm
@@ -25,32 +26,33 @@ def worker_segment(input_queue: Queue, output_queue: Queue, max_segments_per_win
             log.debug(f"Core {core_number}: No more jobs for worker_segment")
             break
         
-        log.debug(f"Core {core_number}: Processing job in worker_segment")
-        sparse_matrix, fraction = job
-        llrs = sparse_matrix.met_matrix
-        
-        if sparse_matrix.shape[1] <= 1:
-            # Too few CpG-sites. Nothing to segment.
-            segmentation = np.zeros(sparse_matrix.shape[1])
-            result_tuple = (
-                llrs,
-                segmentation,
-                sparse_matrix.genomic_coord,
-                sparse_matrix.genomic_coord_end,
-                sparse_matrix.read_samples,
-            )
-        else:
-            # Perform segmentation
-            segmentation = segment(sparse_matrix, max_segments_per_window, verbose, core_number, log)
-            result_tuple = (
-                llrs,
-                segmentation,
-                sparse_matrix.genomic_coord,
-                sparse_matrix.genomic_coord_end,
-                sparse_matrix.read_samples,
-            )
-        log.debug(f"Core {core_number}: Putting result in output queue in worker_segment")
-        output_queue.put((result_tuple, fraction))
+        # Jobs are batches of consecutive windows
+        log.debug(f"Core {core_number}: Processing job of {len(job)} windows in worker_segment")
+        for sparse_matrix, fraction in job:
+            llrs = sparse_matrix.met_matrix
+            
+            if sparse_matrix.shape[1] <= 1:
+                # Too few CpG-sites. Nothing to segment.
+                segmentation = np.zeros(sparse_matrix.shape[1])
+                result_tuple = (
+                    llrs,
+                    segmentation,
+                    sparse_matrix.genomic_coord,
+                    sparse_matrix.genomic_coord_end,
+                    sparse_matrix.read_samples,
+                )
+            else:
+                # Perform segmentation
+                segmentation = segment(sparse_matrix, max_segments_per_window, verbose, core_number, log)
+                result_tuple = (
+                    llrs,
+                    segmentation,
+                    sparse_matrix.genomic_coord,
+                    sparse_matrix.genomic_coord_end,
+                    sparse_matrix.read_samples,
+                )
+            log.debug(f"Core {core_number}: Putting result in output queue in worker_segment")
+            output_queue.put((result_tuple, fraction))
 
 
 def worker_output(
@@ -122,6 +124,7 @@ def worker_reader(
     progress_per_chunk: float,
     read_groups_keys: List[str],
     read_groups_to_include: List[str],
+    segment_workers: int = 1,
     core_number: int = None, 
     log: logging.Logger = None,
 ):
@@ -153,11 +156,22 @@ def worker_reader(
             total_sites = len(met_matrix.genomic_coord)
             num_windows = (total_sites // window_size) + 1
             progress_per_window = progress_per_chunk / num_windows
+            
+            # Submit windows in batches to amortize the queue transfer overhead, while keeping enough jobs
+            # per chunk to balance the load between the segmentation workers
+            windows_per_job = max(1, num_windows // (4 * segment_workers))
+            job = []
             for window_start in range(0, total_sites + 1, window_size):
                 window_end = window_start + window_size
-                log.debug(f"Core {core_number}: Submitting window {window_start}-{window_end} in worker_reader")
                 sub_matrix = met_matrix.get_submatrix(window_start, window_end)
-                input_queue.put((sub_matrix, progress_per_window))
+                job.append((sub_matrix, progress_per_window))
+                if len(job) == windows_per_job:
+                    log.debug(f"Core {core_number}: Submitting {len(job)} windows up to {window_end} in worker_reader")
+                    input_queue.put(job)
+                    job = []
+            if job:
+                log.debug(f"Core {core_number}: Submitting {len(job)} windows up to {window_end} in worker_reader")
+                input_queue.put(job)
     log.debug(f"Core {core_number}: Reader worker finished with chunks {chunks}")  # Debug line
 
 
@@ -207,7 +221,7 @@ def Meth_Seg(
     * workers
         Number of worker processes
     * reader_workers
-        Number of reader worker processes
+        Number of reader worker threads
     * progress
         True if  progress bar is desired
     * output_tsv_fn
@@ -259,8 +273,9 @@ def Meth_Seg(
     
     reader_workers = min(reader_workers, len(chunks))
     chunk_per_process = np.array_split(chunks, reader_workers)
-    reader_processes = [
-        Process(
+    # Readers are I/O bound and run as threads of the main process, only the segmentation is spread over processes
+    reader_threads = [
+        Thread(
             target=worker_reader,
             args=(
                 h5_file_list,
@@ -272,14 +287,15 @@ def Meth_Seg(
                 progress_per_chunk,
                 read_groups_keys,
                 read_groups_to_include,
+                workers,
                 core_number, 
                 log,
             ),
         )
         for core_number, p_chunks in enumerate(chunk_per_process)
     ]
-    # for p in reader_processes:
-    #     p.start()
+    # for t in reader_threads:
+    #     t.start()
 
     core_number = 0
     
@@ -298,16 +314,17 @@ def Meth_Seg(
         ),
     )
 
-    for p in reader_processes:
-        p.start()
-
+    # Processes are forked before the reader threads start, so that no reader holds a lock in the forked children
     for p in segmentation_processes:
         p.start()
 
     output_process.start()
     
-    for p in reader_processes:
-        p.join()
+    for t in reader_threads:
+        t.start()
+    
+    for t in reader_threads:
+        t.join()
 
     # Deal poison pills to segmentation workers
     for p in segmentation_processes:
@@ -406,7 +406,9 @@ class Kaleido:
         # Init scopes
         if not STATIC_EXPORT:
             raise ImportError("Static export is not possible due to missing dependencies")
-        self.plotly_scope = PlotlyScope()
+        # The scope keeps a single Chromium subprocess alive between exports. MathJax is not used by any of the
+        # figures and is disabled to avoid fetching it from the CDN when the subprocess starts
+        self.plotly_scope = PlotlyScope(mathjax=False)
     
     def render_plotly_svg(self, fig, width=None, height=None):
         """
@@ -0,0 +1,20 @@
+import unittest
+import numpy as np
+import pandas as pd
+from pycoMeth.Comp_Report import render_df
+
+class TestRenderDf(unittest.TestCase):
+    def test_cache_distinguishes_null_kinds(self):
+        # None and NaN hash alike with pandas but are rendered differently
+        none_df = pd.DataFrame({"x": ["a", None]}, dtype=object)
+        nan_df = pd.DataFrame({"x": ["a", np.nan]}, dtype=object)
+        self.assertNotEqual(none_df.to_html(), nan_df.to_html())
+        self.assertNotEqual(render_df(none_df), render_df(nan_df))
+        self.assertNotEqual(render_df(nan_df), render_df(none_df))
+
+    def test_cache_returns_same_rendering(self):
+        df = pd.DataFrame({"x": ["a", None], "y": [1, 2]})
+        self.assertEqual(render_df(df), render_df(df.copy()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,22 +11,16 @@ from pycoMeth.meth_seg.postprocessing import cleanup_segmentation
 def segment(sparse_matrix: SparseMethylationMatrixContainer, max_segments_per_window: int, verbose: bool = False, core_number: int = None, log: logging.Logger = None):
     log.debug(f"Core {core_number}: Starting segmentation")
     
-    log.debug(f"Core {core_number}: Converting sparse matrix to dense")
-    llrs = np.array(sparse_matrix.met_matrix.todense())
-    
     log.debug(f"Core {core_number}: Converting llrs to probabilities")
-    obs = llr_to_p(llrs)
-    samples = sparse_matrix.read_samples
-    
-    log.debug(f"Core {core_number}: Getting unique samples")
-    unique_samples = list(set(samples))
-    
-    log.debug(f"Core {core_number}: Creating sample dictionaries")
-    id_sample_dict = {i: s for i, s in enumerate(unique_samples)}
-    sample_id_dict = {v: k for k, v in id_sample_dict.items()}
+    # Only the stored llrs are converted, missing observations are labeled -1 so the emission likelihood skips them
+    met_matrix = sparse_matrix.met_matrix.tocsr()
+    read_idx = np.repeat(np.arange(met_matrix.shape[0]), np.diff(met_matrix.indptr))
+    # Probabilities are stored in single precision, plenty for the emissions and half the memory traffic in the HMM
+    obs = np.full(met_matrix.shape, -1, dtype=np.float32)
+    obs[read_idx, met_matrix.indices] = llr_to_p(met_matrix.data)
     
     log.debug(f"Core {core_number}: Converting samples to ids")
-    sample_ids = np.array([sample_id_dict[s] for s in samples])
+    unique_samples, sample_ids = np.unique(np.asarray(sparse_matrix.read_samples), return_inverse=True)
     
     log.debug(f"Core {core_number}: Creating emission likelihoods")
     emission_lik = BernoulliPosterior(len(unique_samples), max_segments_per_window, prior_a=None)
@@ -38,14 +32,17 @@ def segment(sparse_matrix: SparseMethylationMatrixContainer, max_segments_per_wi
     
     log.debug(f"Core {core_number}: Running Baum-Welch algorithm")
     
-    segment_p_hmml, posterior_hmml = hmm.baum_welch_hmml(obs, tol=np.exp(-8), samples=sample_ids, verbose = verbose)
+    # hmmlearn has no notion of missing observations, give it the neutral probability instead
+    segment_p_hmml, posterior_hmml = hmm.baum_welch_hmml(
+        np.where(obs == -1, 0.5, obs), tol=np.exp(-8), samples=sample_ids, verbose=verbose
+    )
     segment_p, posterior = hmm.baum_welch(obs, tol=np.exp(-8), samples=sample_ids, verbose = verbose)
     
     log.debug(f"Core {core_number}: Running MAP estimation")
     segmentation, _ = hmm.MAP(posterior)
     
     log.debug(f"Core {core_number}: Cleaning up segmentation")
-    segment_p_array = np.concatenate([v[np.newaxis, :] for v in segment_p.values()], axis=0)
+    segment_p_array = np.stack(list(segment_p.values()), axis=0)
     segmentation = cleanup_segmentation(segment_p_array, segmentation, min_parameter_diff=0.2)
     
     log.debug(f"Core {core_number}: Finished segmentation")
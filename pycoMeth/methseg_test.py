@@ -25,7 +25,7 @@ class TestMethSeg(unittest.TestCase):
         while p.is_alive():
             active_processes = multiprocessing.active_children()
             print(f'Active child processes: {len(active_processes)}')  # print the number of active child processes
-            self.assertEqual(len(active_processes), workers + reader_workers + 1)  # +1 for the Meth_Seg process itself
+            self.assertEqual(len(active_processes), workers + 1)  # +1 for the Meth_Seg process itself, readers are threads
             time.sleep(1)  # wait for 1 second
 
         # Join the Meth_Seg process